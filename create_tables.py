@@ -1,9 +1,26 @@
 # create_tables.py
+import asyncio
+
 from database import engine, Base
 # import models to register tables with Base
 import models  # noqa: F401
 
+
+def _create_all(conn):
+    Base.metadata.create_all(bind=conn)
+    # create_all 不会给已存在的表补索引（例如后加的 child_id + created_at 复合索引），这里单独补一遍
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(_create_all)
+    await engine.dispose()
+
+
 if __name__ == "__main__":
     print("Creating tables (if not exist)...")
-    Base.metadata.create_all(bind=engine)
+    asyncio.run(main())
     print("Done.")
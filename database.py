@@ -1,51 +1,107 @@
 # /path/to/your/project/database.py
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
 
 # 从环境变量读取 DATABASE_URL；开发时可使用 sqlite（仅限本地）
 # 在 Render 或其它 PaaS 上请确保 DATABASE_URL 指向托管的 Postgres / MySQL 等
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./data.db")
 
+# 全部走异步驱动：postgres -> asyncpg，sqlite -> aiosqlite
+# （Render 给的是 postgres://... / postgresql://...，这里统一换成对应的 async 方言）
+_url = make_url(DATABASE_URL)
+_ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+_url = _url.set(drivername=_ASYNC_DRIVERS.get(_url.drivername, _url.drivername))
+
 # 是否为 sqlite（本地开发）
-_is_sqlite = DATABASE_URL.startswith("sqlite")
+_is_sqlite = _url.get_backend_name() == "sqlite"
 
 # 通用 engine 选项
-engine_kwargs = {"future": True}
+engine_kwargs = {}
 
-# sqlite 需要特殊 connect_args
 if _is_sqlite:
-    engine_kwargs["connect_args"] = {"check_same_thread": False}
     # sqlite 不需要连接池配置（也不建议在 PaaS 上使用 sqlite）
+    pass
 else:
     # 生产 / PaaS 下的连接池优化（可通过环境变量调节）
     # Render 上通常会提供一个 Postgres DATABASE_URL（格式示例：postgres://...）
-    pool_size = int(os.environ.get("DATABASE_POOL_SIZE", 5))
-    max_overflow = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+    # 全异步之后一个 worker 能同时挂很多请求，默认池子放大一些；
+    # 注意 总连接数 ≈ worker 数 × (pool_size + max_overflow)，别超过数据库的 max_connections
+    pool_size = int(os.environ.get("DATABASE_POOL_SIZE", 10))
+    max_overflow = int(os.environ.get("DATABASE_MAX_OVERFLOW", 20))
     pool_timeout = int(os.environ.get("DATABASE_POOL_TIMEOUT", 30))
-    # pool_pre_ping 可帮助在长连接失效时自动重连
+    # pool_recycle：在 PgBouncer 的 server_idle_timeout 之前主动换掉旧连接
+    pool_recycle = int(os.environ.get("DATABASE_POOL_RECYCLE", 60))
+    # pool_pre_ping 可帮助在长连接失效时自动重连；
+    # 但在 PgBouncer 事务池模式下，ping 会开一个隐式事务把后端连接占住，
+    # 这种部署请设 DATABASE_POOL_PRE_PING=false
+    pool_pre_ping = os.environ.get("DATABASE_POOL_PRE_PING", "true").lower() in (
+        "1", "true", "yes"
+    )
     engine_kwargs.update(
         {
-            "pool_pre_ping": True,
             "pool_size": pool_size,
             "max_overflow": max_overflow,
             "pool_timeout": pool_timeout,
+            "pool_recycle": pool_recycle,
         }
     )
+    if pool_pre_ping:
+        engine_kwargs["pool_pre_ping"] = True
+
+    connect_args = {}
+
+    # asyncpg 不认 libpq 的 sslmode 参数，挪到 connect_args 里的 ssl
+    if "sslmode" in _url.query:
+        connect_args["ssl"] = _url.query["sslmode"]
+        _url = _url.difference_update_query(["sslmode"])
+
+    # asyncpg 每条连接缓存服务端预编译语句（热点 SELECT 省掉 parse + plan）；
+    # PgBouncer 事务池模式下预编译语句会串到别的后端连接上，这种部署请设为 0 关掉
+    stmt_cache_size = int(os.environ.get("DATABASE_STATEMENT_CACHE_SIZE", 500))
+    _url = _url.update_query_dict({"prepared_statement_cache_size": str(stmt_cache_size)})
+    if stmt_cache_size == 0:
+        connect_args["statement_cache_size"] = 0
+
+    if connect_args:
+        engine_kwargs["connect_args"] = connect_args
+
+# SQLAlchemy 编译缓存（SQL 字符串按语句结构缓存），默认 500 条，留足余量
+engine_kwargs["query_cache_size"] = int(os.environ.get("DATABASE_QUERY_CACHE_SIZE", 1200))
 
 # 是否打印 SQL（便于本地调试）
 echo_flag = os.environ.get("DATABASE_ECHO", "false").lower() in ("1", "true", "yes")
 
 # 创建 engine
-engine = create_engine(DATABASE_URL, echo=echo_flag, **engine_kwargs)
+engine = create_async_engine(_url, echo=echo_flag, **engine_kwargs)
+
+if _is_sqlite:
+    # WAL + synchronous=NORMAL：提交时不再每次都 fsync 整个库，读写也不互相阻塞
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        # 临时表 / 排序放内存，页缓存开到 64 MiB（负数单位是 KiB）
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA cache_size=-65536")
+        cur.close()
 
-# SessionLocal 用于依赖注入（FastAPI/Flask 等）
-SessionLocal = sessionmaker(
+# SessionLocal 用于依赖注入（FastAPI 里 async with SessionLocal() as db）
+SessionLocal = async_sessionmaker(
     bind=engine,
-    autocommit=False,
+    class_=AsyncSession,
     autoflush=False,
     expire_on_commit=False,
 )
 
-# Base 用于模型继承
-Base = declarative_base()
+# Base 用于模型继承（SQLAlchemy 2.0 写法）
+class Base(DeclarativeBase):
+    pass
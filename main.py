@@ -1,26 +1,33 @@
 from __future__ import annotations
 
 from typing import List, Optional
-import threading
-import time
+import asyncio
+import logging
+import os
+import uuid
 
-import cv2
-import numpy as np
-from fastapi import FastAPI, Depends, HTTPException
+import ahocorasick
+import orjson
+
+from fastapi import FastAPI, Depends, Header, HTTPException, Query
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
+from sqlalchemy import bindparam, false, insert, lambda_stmt, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # 本地模块
 from database import Base, engine, SessionLocal
-from models import Environment, TextLog, Alert, Reminder, HealthStatus, AiLog
+from models import Environment, TextLog, Alert, Reminder, HealthStatus, AiLog, as_utc, utcnow
 from schemas import (
-    EnvironmentIn, EnvironmentOut,
+    EnvironmentIn, EnvironmentBatchIn, EnvironmentOut,
     TextLogIn, TextLogOut,
     AlertOut,
     ReminderIn, ReminderOut,
     HealthIn, HealthOut,
     AiLogOut,   # ✅ 新增
 )
+from video import frame_generator, start_video, stop_video
 
 
 # ================================================================
@@ -43,14 +50,68 @@ def normalize_child_id(child_id: Optional[str]) -> str:
 # FastAPI 初始化 + Database 初始化
 # ================================================================
 app = FastAPI(title="Remote Care API (Unified, UDP Video)")
-Base.metadata.create_all(bind=engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
+# 列表接口的 JSON 数组重复字段很多，gzip 能压到 1/5~1/10；小响应不压。
+# /video 的 MJPEG 流本身就是 JPEG，压了没用，还会被压缩缓冲拖慢出帧，所以排除掉
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=1024,
+    compresslevel=5,
+    exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES + ("multipart/x-mixed-replace",),
+)
+
+# 建表交给 create_tables.py（render.yaml 启动前会先跑一次）；
+# 本地开发想省事可以设 CREATE_TABLES_ON_STARTUP=1，让每个 worker 启动时自己建
+CREATE_TABLES_ON_STARTUP = (
+    os.getenv("CREATE_TABLES_ON_STARTUP", "0").lower() in ("1", "true", "yes")
+)
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+def _by_child_stmt(model):
+    """
+    WHERE child_id = :cid ORDER BY created_at DESC LIMIT :limit，
+    用 lambda_stmt 包起来，SQL 只编译一次，之后按 lambda 位置直接命中缓存。
+    只选表里的列、不选 ORM 实体：结果是普通 Row，不建 ORM 对象、不进 identity map，
+    列表接口拿 .mappings() 直接交给 response_model 校验 + 序列化。
+    """
+    return lambda_stmt(
+        lambda: select(*model.__table__.c)
+        .where(model.child_id == bindparam("cid"))
+        .order_by(model.created_at.desc())
+        .limit(bindparam("limit"))
+    )
+
+# 列表接口默认只返回最近 100 条，最多 1000 条
+ListLimit = Query(100, ge=1, le=1000)
+
+# 列表接口在请求头带 Accept: application/x-ndjson 时改成逐行流式输出：
+# 数据库游标读一行发一行，不用先把整批 ORM 对象和 JSON 数组攒在内存里；
+# 不带这个头的老客户端照旧拿 JSON 数组
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def wants_ndjson(accept: Optional[str] = Header(None)) -> bool:
+    return accept is not None and NDJSON_MEDIA_TYPE in accept
+
+# NDJSON 行直接用 orjson 序列化（datetime 原生支持，UTC 输出成 Z 和 pydantic 一致）
+_ORJSON_NDJSON = orjson.OPT_APPEND_NEWLINE | orjson.OPT_UTC_Z
+
+# 流式输出时游标每次取这么多行，拼成一块发出去（而不是一行一次 send）
+NDJSON_CHUNK_ROWS = 500
+
+def ndjson_response(db: AsyncSession, stmt, params: dict) -> StreamingResponse:
+    async def rows():
+        # get_db 默认是 request 作用域，响应发完之前 session 都还开着
+        result = await db.stream(
+            stmt, params, execution_options={"yield_per": NDJSON_CHUNK_ROWS}
+        )
+        async for chunk in result.mappings().partitions():
+            # 列和 *Out schema 一一对应，数据库里出来的行不用再过一遍 pydantic 校验
+            yield b"".join(orjson.dumps(dict(row), option=_ORJSON_NDJSON) for row in chunk)
+
+    return StreamingResponse(rows(), media_type=NDJSON_MEDIA_TYPE)
 
 @app.get("/")
 def ping():
@@ -61,7 +122,7 @@ def ping():
 # 环境数据（带噪音）
 # ================================================================
 @app.post("/api/environment", response_model=EnvironmentOut)
-def create_environment(item: EnvironmentIn, db: Session = Depends(get_db)):
+async def create_environment(item: EnvironmentIn, db: AsyncSession = Depends(get_db)):
     # ✅ 不传 child_id 时自动使用 DEFAULT_CHILD_ID
     child_id = normalize_child_id(item.child_id)
 
@@ -72,37 +133,173 @@ def create_environment(item: EnvironmentIn, db: Session = Depends(get_db)):
         light_lux=item.light_lux,
         noise_db=item.noise_db,
     )
+    # 环境数据和命中的预警放在同一个事务里，跑完规则只 commit 一次
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
-
-    # 自动分析规则
-    analyze_environment(db, obj)
+    alerts: List[dict] = []
+    analyze_environment(alerts, obj)
+    await save_alerts(db, alerts)
+    await db.commit()
 
     # 你 schemas.py 里用了 from_attributes=True，可以直接这样返回
     return EnvironmentOut.model_validate(obj)
 
+_ENVIRONMENT_BY_CHILD = _by_child_stmt(Environment)
+
 @app.get("/api/environment", response_model=List[EnvironmentOut])
-def list_environment(child_id: Optional[str] = None,
-                     db: Session = Depends(get_db)):
+async def list_environment(child_id: Optional[str] = None,
+                           limit: int = ListLimit,
+                           db: AsyncSession = Depends(get_db),
+                           ndjson: bool = Depends(wants_ndjson)):
     cid = normalize_child_id(child_id)
-    q = (
-        db.query(Environment)
-        .filter(Environment.child_id == cid)
-        .order_by(Environment.created_at.desc())
-        .all()
-    )
-    return [EnvironmentOut.model_validate(o) for o in q]
+    if ndjson:
+        return ndjson_response(db, _ENVIRONMENT_BY_CHILD, {"cid": cid, "limit": limit})
+    q = (await db.execute(_ENVIRONMENT_BY_CHILD, {"cid": cid, "limit": limit})).mappings().all()
+    # 直接返回行映射，response_model 在 pydantic-core 里一次性校验 + 序列化
+    return q
+
+# 网关攒了一批读数一次性上传：Postgres 上走 asyncpg 的 COPY（二进制协议，比逐行 INSERT 快一个量级），
+# 其它数据库退回一条 executemany INSERT；规则照常跑，命中的预警和读数在同一个事务里提交
+ENVIRONMENT_BATCH_MAX = 10000
+_ENVIRONMENT_COPY_COLUMNS = (
+    "child_id", "temperature", "humidity", "light_lux", "noise_db", "created_at",
+)
+_INSERT_ENVIRONMENT = insert(Environment)
+
+@app.post("/api/environment/batch")
+async def create_environment_batch(items: List[EnvironmentBatchIn],
+                                   db: AsyncSession = Depends(get_db)):
+    if len(items) > ENVIRONMENT_BATCH_MAX:
+        raise HTTPException(
+            status_code=413, detail=f"at most {ENVIRONMENT_BATCH_MAX} readings per batch"
+        )
+
+    now = utcnow()
+    rows = [
+        {
+            "child_id": normalize_child_id(item.child_id),
+            "temperature": item.temperature,
+            "humidity": item.humidity,
+            "light_lux": item.light_lux,
+            "noise_db": item.noise_db,
+            "created_at": as_utc(item.created_at) if item.created_at else now,
+        }
+        for item in items
+    ]
+    if not rows:
+        return {"ok": True, "count": 0, "alerts": 0}
+
+    if engine.dialect.name == "postgresql":
+        # asyncpg 适配层的 BEGIN 是懒发送的（第一条 execute 才发），直接 COPY 会落在自动提交里；
+        # 先经 SQLAlchemy 跑一条语句把事务开起来，COPY 和预警才会一起提交 / 回滚
+        conn = await db.connection()
+        await conn.exec_driver_sql("SELECT 1")
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            Environment.__tablename__,
+            records=[tuple(r[c] for c in _ENVIRONMENT_COPY_COLUMNS) for r in rows],
+            columns=_ENVIRONMENT_COPY_COLUMNS,
+        )
+    else:
+        await db.execute(_INSERT_ENVIRONMENT, rows)
+
+    alerts: List[dict] = []
+    for r in rows:
+        analyze_environment(alerts, Environment(**r))
+    await save_alerts(db, alerts)
+    await db.commit()
+
+    return {"ok": True, "count": len(rows), "alerts": len(alerts)}
 
 # ================================================================
 # 文本情绪
 # ================================================================
-@app.post("/api/textlog")
-def create_textlog(item: TextLogIn, db: Session = Depends(get_db)):
+# 文本日志走写后队列：POST 只入队，后台任务攒一批（最多 TEXTLOG_BATCH_SIZE 条，
+# 或等 TEXTLOG_FLUSH_INTERVAL 秒）一次 add_all + commit，设备突发上报时不再每条 fsync 一次
+TEXTLOG_BATCH_SIZE = 100
+TEXTLOG_FLUSH_INTERVAL = 0.05
+
+# 队列和写入任务都在 startup 里建：asyncio.Queue 会绑定第一次用它的事件循环，
+# 模块导入时建的话，同一进程里第二次启动 app（测试里常见）就用不了了
+_textlog_queue: Optional[asyncio.Queue] = None
+_textlog_writer_task: Optional[asyncio.Task] = None
+
+# 写库失败时按这个间隔重试，全部失败才放弃并把丢掉的行打进日志（POST 早已回了 202，不能悄悄丢）
+TEXTLOG_RETRY_DELAYS = (0.5, 2.0, 5.0)
+
+logger = logging.getLogger("starbridge.textlog")
+
+async def _write_textlogs(items: list):
+    """整批入库，孩子文本顺便跑情绪规则，只 commit 一次。
+
+    队列里放的是 (模型, 字段) 而不是 ORM 对象：每次重试都新建实例，
+    不会把上一次失败 session 里残留的状态带进来。
+    """
+    objs = [model(**values) for model, values, _ in items]
+    async with SessionLocal() as db:
+        db.add_all(objs)
+        alerts: List[dict] = []
+        for obj in objs:
+            if isinstance(obj, TextLog):
+                analyze_textlog(alerts, obj)
+        await save_alerts(db, alerts)
+        await db.commit()
+
+async def _flush_textlogs(batch: list):
+    for delay in (*TEXTLOG_RETRY_DELAYS, None):
+        try:
+            await _write_textlogs(batch)
+            return
+        except Exception:
+            if delay is None:
+                logger.exception("textlog flush failed, dropping %d rows", len(batch))
+                for model, values, provisional_id in batch:
+                    logger.error("dropped %s row %s: %r", model.__tablename__, provisional_id, values)
+                return
+            logger.warning("textlog flush failed, retrying in %.1fs", delay, exc_info=True)
+            await asyncio.sleep(delay)
+
+async def _textlog_writer():
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        first = await _textlog_queue.get()
+        if first is None:
+            break
+        batch = [first]
+        deadline = loop.time() + TEXTLOG_FLUSH_INTERVAL
+        while len(batch) < TEXTLOG_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                obj = await asyncio.wait_for(_textlog_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if obj is None:   # 关停信号：把手上这批写完再退出
+                stopping = True
+                break
+            batch.append(obj)
+
+        await _flush_textlogs(batch)
+
+def _enqueue_textlog(model, values: dict) -> str:
+    """入队并返回临时 id；写入任务没在跑（没启动或已经挂了）时直接 503，不能回 202 再悄悄丢掉。"""
+    if _textlog_writer_task is None or _textlog_writer_task.done():
+        raise HTTPException(status_code=503, detail="textlog writer is not running")
+    provisional_id = uuid.uuid4().hex
+    # created_at 按收到请求的时间记，不按攒批 / 重试后真正写库的时间
+    values["created_at"] = utcnow()
+    _textlog_queue.put_nowait((model, values, provisional_id))
+    return provisional_id
+
+@app.post("/api/textlog", status_code=202)
+async def create_textlog(item: TextLogIn):
     """
     同一个接口：
     - {"content": "..."}  -> 孩子说的话，写 TextLog
     - {"text": "..."}     -> AI 说的话，写 AiLog
+    只入队就返回 202，真正落库由 _textlog_writer 批量完成，所以这里还没有数据库 id；
+    返回的 provisional_id 只标识这一次提交，这一批最终写库失败时会跟着被丢的行一起打进日志，方便对账。
     """
     child_id = normalize_child_id(item.child_id)
 
@@ -120,91 +317,98 @@ def create_textlog(item: TextLogIn, db: Session = Depends(get_db)):
         if score is None:
             score = rule_based_sentiment(content)
 
-        obj = TextLog(
-            child_id=child_id,
-            content=content,
-            sentiment=score,
+        provisional_id = _enqueue_textlog(
+            TextLog, {"child_id": child_id, "content": content, "sentiment": score}
         )
-        db.add(obj)
-        db.commit()
-        db.refresh(obj)
-
-        analyze_textlog(db, obj)
 
         return {
             "ok": True,
             "kind": "child",  # 标记一下是孩子文本
-            "data": TextLogOut.model_validate(obj),
+            "queued": True,
+            "provisional_id": provisional_id,
+            "data": {"child_id": child_id, "content": content, "sentiment": score},
         }
 
     # ================== 情况 2：没有 content，有 text（AI 回复） ==================
-    obj = AiLog(
-        child_id=child_id,
-        text=ai_text,
-    )
-    db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    provisional_id = _enqueue_textlog(AiLog, {"child_id": child_id, "text": ai_text})
 
     return {
         "ok": True,
         "kind": "ai",   # 标记一下是 AI 文本
-        "data": AiLogOut.model_validate(obj),
+        "queued": True,
+        "provisional_id": provisional_id,
+        "data": {"child_id": child_id, "text": ai_text},
     }
 
 
-from typing import Optional
+_TEXTLOG_BY_CHILD = _by_child_stmt(TextLog)
+_AILOG_BY_CHILD = _by_child_stmt(AiLog)
 
 @app.get("/api/textlog", response_model=List[TextLogOut])
-def list_textlog(child_id: Optional[str] = None,
-                 db: Session = Depends(get_db)):
+async def list_textlog(child_id: Optional[str] = None,
+                       limit: int = ListLimit,
+                       db: AsyncSession = Depends(get_db),
+                       ndjson: bool = Depends(wants_ndjson)):
     # 没传就用 DEFAULT_CHILD_ID（"default"）
     cid = normalize_child_id(child_id)
 
-    q = (
-        db.query(TextLog)
-        .filter(TextLog.child_id == cid)
-        .order_by(TextLog.created_at.desc())
-        .all()
-    )
-    return [TextLogOut.model_validate(o) for o in q]
+    if ndjson:
+        return ndjson_response(db, _TEXTLOG_BY_CHILD, {"cid": cid, "limit": limit})
+    q = (await db.execute(_TEXTLOG_BY_CHILD, {"cid": cid, "limit": limit})).mappings().all()
+    return q
 
 @app.get("/api/textlog/ai", response_model=List[AiLogOut])
-def list_ai_textlog(child_id: Optional[str] = None,
-                    db: Session = Depends(get_db)):
+async def list_ai_textlog(child_id: Optional[str] = None,
+                          limit: int = ListLimit,
+                          db: AsyncSession = Depends(get_db),
+                          ndjson: bool = Depends(wants_ndjson)):
     cid = normalize_child_id(child_id)
-    q = (
-        db.query(AiLog)
-        .filter(AiLog.child_id == cid)
-        .order_by(AiLog.created_at.desc())
-        .all()
-    )
-    return [AiLogOut.model_validate(o) for o in q]
+    if ndjson:
+        return ndjson_response(db, _AILOG_BY_CHILD, {"cid": cid, "limit": limit})
+    q = (await db.execute(_AILOG_BY_CHILD, {"cid": cid, "limit": limit})).mappings().all()
+    return q
 
 
 
 # ================================================================
 # 预警
 # ================================================================
-@app.get("/api/reminder", response_model=List[ReminderOut])
-def list_reminder(child_id: Optional[str] = None,
-                  db: Session = Depends(get_db)):
+_ALERT_BY_CHILD = _by_child_stmt(Alert)
+# unacked=true 时只查未确认的预警，条件和 models.py 里的部分索引 ix_alerts_child_unacked 一致
+_UNACKED_ALERT_BY_CHILD = lambda_stmt(
+    lambda: select(*Alert.__table__.c)
+    .where(Alert.child_id == bindparam("cid"), Alert.acknowledged == false())
+    .order_by(Alert.created_at.desc())
+    .limit(bindparam("limit"))
+)
+
+@app.get("/api/alerts", response_model=List[AlertOut])
+async def list_alerts(child_id: Optional[str] = None,
+                      unacked: bool = False,
+                      limit: int = ListLimit,
+                      db: AsyncSession = Depends(get_db),
+                      ndjson: bool = Depends(wants_ndjson)):
     cid = normalize_child_id(child_id)
-    q = (
-        db.query(Reminder)
-        .filter(Reminder.child_id == cid)
-        .order_by(Reminder.created_at.desc())
-        .all()
-    )
-    return [ReminderOut.model_validate(o) for o in q]
+    stmt = _UNACKED_ALERT_BY_CHILD if unacked else _ALERT_BY_CHILD
+    if ndjson:
+        return ndjson_response(db, stmt, {"cid": cid, "limit": limit})
+    q = (await db.execute(stmt, {"cid": cid, "limit": limit})).mappings().all()
+    return q
+
+# 一条 UPDATE ... RETURNING 搞定，不用先 SELECT 再 UPDATE 两个来回
+_ACK_ALERT = (
+    update(Alert)
+    .where(Alert.id == bindparam("aid"))
+    .values(acknowledged=True)
+    .returning(Alert.id)
+)
 
 @app.post("/api/alerts/{aid}/ack")
-def ack_alert(aid: int, db: Session = Depends(get_db)):
-    o = db.get(Alert, aid)
-    if not o:
+async def ack_alert(aid: int, db: AsyncSession = Depends(get_db)):
+    acked = (await db.execute(_ACK_ALERT, {"aid": aid})).scalar()
+    if acked is None:
         return {"ok": False, "msg": "not found"}
-    o.acknowledged = True
-    db.commit()
+    await db.commit()
     return {"ok": True}
 
 
@@ -212,7 +416,7 @@ def ack_alert(aid: int, db: Session = Depends(get_db)):
 # 提醒
 # ================================================================
 @app.post("/api/reminder", response_model=ReminderOut)
-def create_reminder(item: ReminderIn, db: Session = Depends(get_db)):
+async def create_reminder(item: ReminderIn, db: AsyncSession = Depends(get_db)):
     child_id = normalize_child_id(item.child_id)
 
     obj = Reminder(
@@ -222,22 +426,29 @@ def create_reminder(item: ReminderIn, db: Session = Depends(get_db)):
         channel=item.channel,
     )
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await db.commit()
 
     return ReminderOut.model_validate(obj)
 
+_REMINDER_BY_CHILD = _by_child_stmt(Reminder)
+
 @app.get("/api/reminder", response_model=List[ReminderOut])
-def list_reminder(child_id: str, db: Session = Depends(get_db)):
-    q = db.query(Reminder).filter(Reminder.child_id == child_id).all()
-    return [ReminderOut.model_validate(o) for o in q]
+async def list_reminder(child_id: Optional[str] = None,
+                        limit: int = ListLimit,
+                        db: AsyncSession = Depends(get_db),
+                        ndjson: bool = Depends(wants_ndjson)):
+    cid = normalize_child_id(child_id)
+    if ndjson:
+        return ndjson_response(db, _REMINDER_BY_CHILD, {"cid": cid, "limit": limit})
+    q = (await db.execute(_REMINDER_BY_CHILD, {"cid": cid, "limit": limit})).mappings().all()
+    return q
 
 
 # ================================================================
 # ✅ 个人健康：心率 & 血氧
 # ================================================================
 @app.post("/api/health", response_model=HealthOut)
-def create_health(item: HealthIn, db: Session = Depends(get_db)):
+async def create_health(item: HealthIn, db: AsyncSession = Depends(get_db)):
     child_id = normalize_child_id(item.child_id)
 
     obj = HealthStatus(
@@ -246,39 +457,48 @@ def create_health(item: HealthIn, db: Session = Depends(get_db)):
         spo2=item.spo2,
     )
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
-
-    analyze_health(db, obj)
+    alerts: List[dict] = []
+    analyze_health(alerts, obj)
+    await save_alerts(db, alerts)
+    await db.commit()
 
     return HealthOut.model_validate(obj)
 
+_HEALTH_BY_CHILD = _by_child_stmt(HealthStatus)
+
 @app.get("/api/health", response_model=List[HealthOut])
-def list_health(child_id: Optional[str] = None,
-                db: Session = Depends(get_db)):
+async def list_health(child_id: Optional[str] = None,
+                      limit: int = ListLimit,
+                      db: AsyncSession = Depends(get_db),
+                      ndjson: bool = Depends(wants_ndjson)):
     cid = normalize_child_id(child_id)
-    q = (
-        db.query(HealthStatus)
-        .filter(HealthStatus.child_id == cid)
-        .order_by(HealthStatus.created_at.desc())
-        .all()
-    )
-    return [HealthOut.model_validate(o) for o in q]
+    if ndjson:
+        return ndjson_response(db, _HEALTH_BY_CHILD, {"cid": cid, "limit": limit})
+    q = (await db.execute(_HEALTH_BY_CHILD, {"cid": cid, "limit": limit})).mappings().all()
+    return q
 
 
 # ================================================================
 # 规则引擎
 # ================================================================
+# 预警不需要 ORM 对象：规则只攒成 dict，最后用一条 Core INSERT 走 executemany 一次写完，
+# 省掉每条 Alert 的实例化、identity map 和 unit-of-work 开销
+_INSERT_ALERT = insert(Alert)
+
 def create_alert(
-    db: Session, *, child_id: str, level: str, title: str, message: str, source: str
+    alerts: List[dict], *, child_id: str, level: str, title: str, message: str, source: str
 ):
-    a = Alert(
-        child_id=child_id, level=level, title=title, message=message, source=source
+    """只记下要写的预警，由调用方 save_alerts + commit 统一提交。"""
+    alerts.append(
+        {"child_id": child_id, "level": level, "title": title,
+         "message": message, "source": source}
     )
-    db.add(a)
-    db.commit()
 
-def analyze_environment(db: Session, env: Environment):
+async def save_alerts(db: AsyncSession, alerts: List[dict]):
+    if alerts:
+        await db.execute(_INSERT_ALERT, alerts)
+
+def analyze_environment(alerts: List[dict], env: Environment):
     t = env.temperature
     h = env.humidity
     lx = env.light_lux
@@ -288,7 +508,7 @@ def analyze_environment(db: Session, env: Environment):
     if t is not None and (t < 16 or t > 29):
         lvl = "critical" if (t < 14 or t > 31) else "warn"
         create_alert(
-            db,
+            alerts,
             child_id=env.child_id,
             level=lvl,
             source="environment",
@@ -299,7 +519,7 @@ def analyze_environment(db: Session, env: Environment):
     # 湿度
     if h is not None and (h < 30 or h > 75):
         create_alert(
-            db,
+            alerts,
             child_id=env.child_id,
             level="warn",
             source="environment",
@@ -310,7 +530,7 @@ def analyze_environment(db: Session, env: Environment):
     # 光照
     if lx is not None and lx < 50:
         create_alert(
-            db,
+            alerts,
             child_id=env.child_id,
             level="info",
             source="environment",
@@ -322,7 +542,7 @@ def analyze_environment(db: Session, env: Environment):
     if noise is not None and noise > 65:
         lvl = "critical" if noise > 80 else "warn"
         create_alert(
-            db,
+            alerts,
             child_id=env.child_id,
             level=lvl,
             source="environment",
@@ -330,21 +550,39 @@ def analyze_environment(db: Session, env: Environment):
             message=f"当前噪声约 {noise:.1f} dB，建议降低噪音或更换环境。",
         )
 
+# 情绪关键词：正负词一起建成一个 Aho-Corasick 自动机，一次线性扫描同时判断两边是否命中
+_NEG_WORDS = ["难过", "生气", "害怕", "烦", "讨厌", "哭"]
+_POS_WORDS = ["开心", "喜欢", "高兴", "满意", "放松"]
+
+_SENTIMENT_AC = ahocorasick.Automaton()
+for _w in _NEG_WORDS:
+    _SENTIMENT_AC.add_word(_w, -0.6)
+for _w in _POS_WORDS:
+    _SENTIMENT_AC.add_word(_w, 0.6)
+_SENTIMENT_AC.make_automaton()
+
 def rule_based_sentiment(text: str) -> float:
-    neg = ["难过", "生气", "害怕", "烦", "讨厌", "哭"]
-    pos = ["开心", "喜欢", "高兴", "满意", "放松"]
+    neg = pos = False
+    for _, weight in _SENTIMENT_AC.iter(text):
+        if weight < 0:
+            neg = True
+        else:
+            pos = True
+        if neg and pos:
+            break
+
     score = 0.0
-    if any(w in text for w in neg):
+    if neg:
         score -= 0.6
-    if any(w in text for w in pos):
+    if pos:
         score += 0.6
     return max(-1.0, min(1.0, score))
 
-def analyze_textlog(db: Session, tl: TextLog):
+def analyze_textlog(alerts: List[dict], tl: TextLog):
     s = tl.sentiment or 0.0
     if s <= -0.5:
         create_alert(
-            db,
+            alerts,
             child_id=tl.child_id,
             level="warn",
             source="text",
@@ -352,7 +590,7 @@ def analyze_textlog(db: Session, tl: TextLog):
             message=f"文本情绪得分 {s:.2f}，建议关注沟通。",
         )
 
-def analyze_health(db: Session, h: HealthStatus):
+def analyze_health(alerts: List[dict], h: HealthStatus):
     hr = h.heart_rate
     spo2 = h.spo2
 
@@ -360,7 +598,7 @@ def analyze_health(db: Session, h: HealthStatus):
     if hr is not None and (hr < 55 or hr > 130):
         lvl = "critical" if (hr < 45 or hr > 150) else "warn"
         create_alert(
-            db,
+            alerts,
             child_id=h.child_id,
             level=lvl,
             source="health",
@@ -372,7 +610,7 @@ def analyze_health(db: Session, h: HealthStatus):
     if spo2 is not None and spo2 < 94:
         lvl = "critical" if spo2 < 90 else "warn"
         create_alert(
-            db,
+            alerts,
             child_id=h.child_id,
             level=lvl,
             source="health",
@@ -382,99 +620,42 @@ def analyze_health(db: Session, h: HealthStatus):
 
 
 # ================================================================
-# ✅ UDP 视频接收 + MJPEG 输出（保持不变）
+# ✅ UDP 视频接收 + MJPEG 输出（接收进程 + 共享内存，见 video.py）
 # ================================================================
-UDP_IP = "0.0.0.0"
-UDP_PORT = 8080
-UDP_RECV_BUFSIZE = 1024 * 1024
-
-FRAME_SIZE = (360, 640)
-
-_latest_frame: Optional[np.ndarray] = None
-_latest_lock = threading.Lock()
-_stop_flag = False
-
-def _udp_receiver():
-    from socket import socket, AF_INET, SOCK_DGRAM, timeout as SocketTimeout
-
-    global _latest_frame
-
-    sock = socket(AF_INET, SOCK_DGRAM)
-    sock.bind((UDP_IP, UDP_PORT))
-    sock.settimeout(1.0)
-    print(f"[UDP] Listening on {UDP_IP}:{UDP_PORT}")
-
-    while not _stop_flag:
-        try:
-            data, addr = sock.recvfrom(UDP_RECV_BUFSIZE)
-        except SocketTimeout:
-            continue
-        except Exception as e:
-            print("[UDP] recv error:", e)
-            time.sleep(0.05)
-            continue
-
-        arr = np.frombuffer(data, dtype=np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-        if img is None:
-            continue
-
-        if img.shape[0] != FRAME_SIZE[0] or img.shape[1] != FRAME_SIZE[1]:
-            img = cv2.resize(img, (FRAME_SIZE[1], FRAME_SIZE[0]))
-
-        with _latest_lock:
-            _latest_frame = img
-
-    try:
-        sock.close()
-    except Exception:
-        pass
-    print("[UDP] Receiver stopped.")
-
-def _blank_jpeg() -> bytes:
-    blank = np.zeros((FRAME_SIZE[0], FRAME_SIZE[1], 3), dtype=np.uint8)
-    ok, buf = cv2.imencode(".jpg", blank)
-    return buf.tobytes() if ok else b""
-
-def _encode_jpeg(img: np.ndarray) -> Optional[bytes]:
-    ok, buf = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-    return buf.tobytes() if ok else None
-
-def _frame_generator():
-    boundary = b"--frame\r\n"
-    header = b"Content-Type: image/jpeg\r\n\r\n"
-    blank = _blank_jpeg()
-
-    while True:
-        with _latest_lock:
-            frame = None if _latest_frame is None else _latest_frame.copy()
-
-        jpg = _encode_jpeg(frame) if frame is not None else blank
-        if jpg is None:
-            jpg = blank
-
-        yield boundary + header + jpg + b"\r\n"
-        time.sleep(0.03)
-
 @app.get("/video")
 def video_feed():
     return StreamingResponse(
-        _frame_generator(),
+        frame_generator(),
         media_type="multipart/x-mixed-replace; boundary=frame",
     )
 
-_udp_thread: Optional[threading.Thread] = None
-
 @app.on_event("startup")
-def _on_startup():
-    global _udp_thread, _stop_flag
-    _stop_flag = False
-    _udp_thread = threading.Thread(target=_udp_receiver, daemon=True)
-    _udp_thread.start()
+async def _on_startup():
+    if CREATE_TABLES_ON_STARTUP:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    global _textlog_queue, _textlog_writer_task
+    _textlog_queue = asyncio.Queue()
+    _textlog_writer_task = asyncio.create_task(_textlog_writer())
+
+    start_video()
     print("[APP] Startup complete; UDP receiver running.")
 
 @app.on_event("shutdown")
-def _on_shutdown():
-    global _stop_flag
-    _stop_flag = True
-    print("[APP] Shutdown signal sent; UDP receiver will stop.")
\ No newline at end of file
+async def _on_shutdown():
+    # 先让写后队列把已经收下的文本写完
+    global _textlog_writer_task
+    if _textlog_writer_task is not None:
+        task = _textlog_writer_task
+        if not task.done():
+            _textlog_queue.put_nowait(None)
+            await task
+        elif not task.cancelled() and task.exception() is not None:
+            # 已经挂掉的写入任务只记日志，不让关停本身也跟着报错
+            logger.error("textlog writer crashed", exc_info=task.exception())
+        _textlog_writer_task = None
+
+    await stop_video()
+    await engine.dispose()
+    print("[APP] Shutdown complete; UDP receiver stopped.")
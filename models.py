@@ -1,29 +1,67 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text
-from sqlalchemy.sql import func
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, Index
+from sqlalchemy.sql import false
+from sqlalchemy.types import TypeDecorator
 
 from database import Base
 
+
+def utcnow() -> datetime:
+    # created_at 由应用写入而不是数据库 now()：插入时所有列都是字面值，
+    # 批量导入可以直接走 COPY，插入后也不用再 refresh 回读时间戳
+    return datetime.now(timezone.utc)
+
+
+def as_utc(ts: datetime) -> datetime:
+    # 带时区的换算成 UTC；不带时区的按 UTC 理解
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+class UTCDateTime(TypeDecorator):
+    """
+    统一按 UTC 存取的时间列。SQLite 存 DateTime 会把时区直接丢掉：
+    写入前先换算成 UTC，读出来的不带时区的值再标回 UTC，和 Postgres 上的行为一致。
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return as_utc(value) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
+
 class TextLog(Base):
     __tablename__ = "text_logs"
+    # 列表接口都是 WHERE child_id=? ORDER BY created_at DESC，复合索引直接覆盖
+    __table_args__ = (Index("ix_text_logs_child_created", "child_id", "created_at"),)
     id = Column(Integer, primary_key=True, index=True)
     child_id = Column(String, index=True)
     content = Column(Text)
     sentiment = Column(Float, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(UTCDateTime, default=utcnow)
 
 
 # ✅ 新增：专门存 AI 回复
 class AiLog(Base):
     __tablename__ = "ai_logs"
+    __table_args__ = (Index("ix_ai_logs_child_created", "child_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     child_id = Column(String, index=True)
     text = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(UTCDateTime, default=utcnow)
 
 class Alert(Base):
     __tablename__ = "alerts"
+    __table_args__ = (Index("ix_alerts_child_created", "child_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     child_id = Column(String(64), index=True, nullable=False)
@@ -32,13 +70,23 @@ class Alert(Base):
     message = Column(Text, nullable=False)
     source = Column(String(50), default="other", nullable=False) # environment / text / health / other
     acknowledged = Column(Boolean, default=False, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at = Column(UTCDateTime, default=utcnow, nullable=False)
 
     def __repr__(self):
         return f"<Alert id={self.id} level={self.level} child_id={self.child_id}>"
 
+# 看板主要关心还没确认的预警：只索引 acknowledged = false 的行，确认过的预警越积越多也不会撑大这棵 B 树
+Index(
+    "ix_alerts_child_unacked",
+    Alert.child_id,
+    Alert.created_at,
+    postgresql_where=(Alert.acknowledged == false()),
+    sqlite_where=(Alert.acknowledged == false()),
+)
+
 class Environment(Base):
     __tablename__ = "environments"
+    __table_args__ = (Index("ix_environments_child_created", "child_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     child_id = Column(String(64), index=True, nullable=False)
@@ -46,32 +94,34 @@ class Environment(Base):
     humidity = Column(Float, nullable=True)
     light_lux = Column(Float, nullable=True)
     noise_db = Column(Float, nullable=True)  # ✅ 新增：噪音，单位 dB
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at = Column(UTCDateTime, default=utcnow, nullable=False)
 
     def __repr__(self):
         return f"<Environment id={self.id} child_id={self.child_id}>"
 
 class Reminder(Base):
     __tablename__ = "reminders"
+    __table_args__ = (Index("ix_reminders_child_created", "child_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     child_id = Column(String(64), index=True, nullable=False)
     title = Column(String(255), nullable=False)
     cron = Column(String(64), nullable=False)   # 简化的重复规则
     channel = Column(String(32), default="multi", nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at = Column(UTCDateTime, default=utcnow, nullable=False)
 
     def __repr__(self):
         return f"<Reminder id={self.id} cron={self.cron} child_id={self.child_id}>"
 
 class HealthStatus(Base):
     __tablename__ = "health_status"  # ✅ 新表：个人健康
+    __table_args__ = (Index("ix_health_status_child_created", "child_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     child_id = Column(String(64), index=True, nullable=False)
     heart_rate = Column(Integer, nullable=True)  # 心率（次/分）
     spo2 = Column(Float, nullable=True)         # 血氧饱和度 %
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at = Column(UTCDateTime, default=utcnow, nullable=False)
 
     def __repr__(self):
         return f"<HealthStatus id={self.id} child_id={self.child_id}>"
@@ -65,6 +65,11 @@ class EnvironmentIn(EnvironmentBase):
     child_id: Optional[str] = None
 
 
+class EnvironmentBatchIn(EnvironmentIn):
+    # 网关缓存的读数带上采集时间；不传就用请求到达的时间
+    created_at: Optional[datetime] = None
+
+
 class EnvironmentOut(EnvironmentBase):
     id: int
     child_id: str
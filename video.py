@@ -0,0 +1,701 @@
+# video.py
+"""
+UDP 视频接收 + MJPEG 输出。
+
+接收端跑在独立进程里（解码 / resize 不和 FastAPI 抢 GIL），每来一帧就把拼好的
+multipart 分段写进 POSIX 共享内存；web 进程（gunicorn 多 worker 也一样）只从
+共享内存里读出最新一段推给浏览器，所有 worker 共用同一个 UDP 端口和接收进程。
+
+其它进程（分析 / 推理）可以用 FrameReader 按名字 attach 同一块共享内存读最新帧。
+
+这个模块不依赖 FastAPI，spawn 出来的接收进程只会 import 这里。
+"""
+from __future__ import annotations
+
+import asyncio
+import errno
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import AsyncIterator, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+# 建段 / 接手旧段时用文件锁让 worker 排队；Windows 上没有 fcntl，也没有残留在 /dev/shm 的问题
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# libjpeg-turbo 直连（比 cv2.imencode/imdecode 快 2~3 倍）
+# 没装 PyTurboJPEG 或系统里没有 libturbojpeg 时，自动退回 OpenCV
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    _tj: Optional[TurboJPEG] = TurboJPEG()
+except Exception:
+    _tj = None
+
+# 打开 OpenCV 的 SIMD 优化内核；并行交给接收进程里的解码线程池，
+# OpenCV 自己就不再开线程，免得两层线程抢核
+cv2.setUseOptimized(True)
+cv2.setNumThreads(1)
+
+
+UDP_IP = "0.0.0.0"
+UDP_PORT = 8080
+UDP_RECV_BUFSIZE = 1024 * 1024
+# 每次醒来最多丢弃这么多个积压的旧包，防止包源源不断时一直卡在读空循环里
+UDP_DRAIN_MAX = 64
+# 内核接收缓冲区，突发时不丢帧；Linux 上实际生效值受 net.core.rmem_max 限制，
+# 部署机器上需要 sysctl -w net.core.rmem_max=12582912；可以用 UDP_RCVBUF（字节）覆盖
+UDP_SO_RCVBUF = int(os.getenv("UDP_RCVBUF", str(12 * 1024 * 1024)))
+# 端口被占用时隔 0.5 秒重试 bind 的次数
+UDP_BIND_RETRIES = 6
+
+FRAME_SIZE = (360, 640)
+# 接收进程里并行解码 / 重编码的线程数（只有尺寸不对、需要重编码的帧才会用到）
+VIDEO_DECODE_WORKERS = max(1, int(os.getenv("VIDEO_DECODE_WORKERS", "2")))
+# 发送端保证就是 FRAME_SIZE 时设 ASSUME_FRAME_SIZE=1：连 JPEG 头都不看，收到就原样转发
+ASSUME_FRAME_SIZE = os.getenv("ASSUME_FRAME_SIZE", "0").lower() in ("1", "true", "yes")
+
+# 只有尺寸不对、要重编码时才用；60 对监控画面足够，编码也更快
+JPEG_QUALITY = 60
+
+# 新帧到达时唤醒所有 /video 客户端
+MJPEG_KEEPALIVE = 1.0        # 没有新帧时，最多隔这么久重发一次当前帧
+MJPEG_POLL_INTERVAL = 0.01   # web 进程检查共享内存序号的间隔
+# 每个 /video 客户端最多推这么多帧/秒，发送端帧率再高也不会把慢客户端的带宽挤满；0 表示不限
+MJPEG_MAX_FPS = float(os.getenv("MJPEG_MAX_FPS", "30"))
+# 每隔这么久确认一次建段的 worker 还活着（它被重启 / kill 掉后，其余 worker 要换到新段上）
+SHM_OWNER_CHECK_INTERVAL = 1.0
+# 接收进程退出后（比如端口被占、bind 重试用完）由 owner 重新拉起，间隔从 MIN 开始翻倍，最多 MAX 秒
+RECEIVER_RESTART_MIN = 1.0
+RECEIVER_RESTART_MAX = 30.0
+
+
+# ================================================================
+# JPEG 工具
+# ================================================================
+# 只有这些 SOFn 标记里带尺寸（C4=DHT, C8=JPG, CC=DAC 不是帧头）
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def _jpeg_size(data) -> Optional[Tuple[int, int]]:
+    """
+    只扫 JPEG 头部的段标记，读 SOFn 里的 (高, 宽)，不做解码。
+    不是合法 JPEG 或找不到帧头时返回 None。
+    """
+    n = len(data)
+    if n < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    pos = 2
+    while pos + 4 <= n:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:          # 填充字节
+            pos += 1
+            continue
+        if marker == 0xDA:          # SOS 之后就是熵编码数据了
+            return None
+        if marker in _SOF_MARKERS:
+            if pos + 9 > n:
+                return None
+            h = (data[pos + 5] << 8) | data[pos + 6]
+            w = (data[pos + 7] << 8) | data[pos + 8]
+            return h, w
+        pos += 2 + ((data[pos + 2] << 8) | data[pos + 3])
+    return None
+
+def _decode_jpeg(data) -> Optional[np.ndarray]:
+    """JPEG bytes -> BGR ndarray；解不出来返回 None。"""
+    if _tj is not None:
+        try:
+            return _tj.decode(data, pixel_format=TJPF_BGR)
+        except Exception:
+            return None
+    arr = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(arr, cv2.IMREAD_COLOR)
+
+# 显式关掉 optimize / progressive：都要多扫一遍系数，只换来几个百分点的体积
+_CV2_JPEG_PARAMS = [
+    int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY,
+    int(cv2.IMWRITE_JPEG_OPTIMIZE), 0,
+    int(cv2.IMWRITE_JPEG_PROGRESSIVE), 0,
+]
+
+def _encode_jpeg(img: np.ndarray) -> Optional[bytes]:
+    """BGR ndarray -> JPEG bytes（JPEG_QUALITY，4:2:0 采样，baseline、不做霍夫曼优化）。"""
+    if _tj is not None:
+        try:
+            return _tj.encode(
+                img, quality=JPEG_QUALITY, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420
+            )
+        except Exception:
+            return None
+    ok, buf = cv2.imencode(".jpg", img, _CV2_JPEG_PARAMS)
+    return buf.tobytes() if ok else None
+
+def _blank_jpeg() -> bytes:
+    blank = np.zeros((FRAME_SIZE[0], FRAME_SIZE[1], 3), dtype=np.uint8)
+    return _encode_jpeg(blank) or b""
+
+_MJPEG_PREFIX = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+_MJPEG_SUFFIX = b"\r\n"
+
+def _mjpeg_part(jpg) -> bytes:
+    # 一次 join 拼好整段；jpg 可以是收包缓冲区的 memoryview，这里会拷成独立的 bytes
+    return b"".join((_MJPEG_PREFIX, jpg, _MJPEG_SUFFIX))
+
+# 还没收到画面时发的黑帧，导入时编码一次，之后所有客户端直接复用
+_BLANK_JPEG: bytes = _blank_jpeg()
+_BLANK_PART: bytes = _mjpeg_part(_BLANK_JPEG)
+
+
+# ================================================================
+# 共享内存：[seq u64][slot u64][owner pid u64][槽 0][槽 1]，两个槽轮流写（双缓冲），每个槽是 [length u64][分段]
+# ================================================================
+# 写：seq +1 变奇数 -> 把长度和新分段写进当前没在用的那个槽 -> 更新 slot -> seq +1 变偶数。
+# 读：看到偶数 seq 就去读 slot 指向的槽。发布出去的只有 slot 这一个字，长度和数据在同一个槽里，
+# 不会读到新槽配旧长度；下一次写进的是另一个槽，所以读的过程中只要写端没有再往下写第二帧
+# （读完后 seq 不超过 读前 seq + 2），读到的就是完整的一帧
+_SHM_SEQ = struct.Struct("<Q")
+_SHM_SLOT = struct.Struct("<Q")       # 当前可读的槽号，紧跟在 seq 后面
+_SHM_LEN = struct.Struct("<Q")        # 每个槽开头记自己那一段的长度
+_SHM_OWNER = struct.Struct("<Q")      # 建段并拉起接收进程的 web worker 的 pid
+_SHM_OWNER_OFFSET = _SHM_SEQ.size + _SHM_SLOT.size
+_SHM_HEADER_SIZE = _SHM_OWNER_OFFSET + _SHM_OWNER.size
+FRAME_SLOT_SIZE = 1024 * 1024
+SHM_SIZE = _SHM_HEADER_SIZE + 2 * FRAME_SLOT_SIZE
+
+# 默认名字带上父进程 pid：同一个 gunicorn master 下的 worker 拿到的是同一块，
+# 上次异常退出残留在 /dev/shm 里的旧段也不会被误认；需要固定名字时设 VIDEO_SHM_NAME
+VIDEO_SHM_NAME = os.getenv("VIDEO_SHM_NAME") or f"starbridge_video_{os.getppid()}"
+
+# 段的生命周期由头部的 owner pid 管（见 _open_shm），不交给 resource_tracker：
+# 否则 owner 被 kill 之后，它的 resource_tracker 会按名字把别的 worker 接手后新建的段删掉
+def _attach_shm(name: str) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(name=name)
+    # Python 3.13 之前，attach 也会登记到本进程的 resource_tracker
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+def _create_shm(name: str) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(name=name, create=True, size=SHM_SIZE)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+def _unlink_shm(shm: shared_memory.SharedMemory) -> None:
+    # unlink() 里会再取消一次登记，先补登记，resource_tracker 那边才对得上
+    resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+def _slot_offset(slot: int) -> int:
+    return _SHM_HEADER_SIZE + slot * FRAME_SLOT_SIZE
+
+def _write_part(buf: memoryview, seq: int, part: bytes) -> int:
+    n = len(part)
+    if n > FRAME_SLOT_SIZE - _SHM_LEN.size:
+        return seq
+    slot = _SHM_SLOT.unpack_from(buf, _SHM_SEQ.size)[0] ^ 1
+    off = _slot_offset(slot)
+    seq += 1
+    _SHM_SEQ.pack_into(buf, 0, seq)
+    _SHM_LEN.pack_into(buf, off, n)
+    off += _SHM_LEN.size
+    buf[off:off + n] = part
+    _SHM_SLOT.pack_into(buf, _SHM_SEQ.size, slot)
+    seq += 1
+    _SHM_SEQ.pack_into(buf, 0, seq)
+    return seq
+
+def _read_part(buf: memoryview, last_seq: int) -> Tuple[int, Optional[bytes]]:
+    """有新的完整帧就返回 (新 seq, 分段)，否则返回 (last_seq, None)。"""
+    seq = _SHM_SEQ.unpack_from(buf, 0)[0]
+    if seq == last_seq or seq & 1:
+        return last_seq, None
+    off = _slot_offset(_SHM_SLOT.unpack_from(buf, _SHM_SEQ.size)[0])
+    n = _SHM_LEN.unpack_from(buf, off)[0]
+    off += _SHM_LEN.size
+    if n > FRAME_SLOT_SIZE - _SHM_LEN.size:
+        return last_seq, None
+    part = bytes(buf[off:off + n])
+    if _SHM_SEQ.unpack_from(buf, 0)[0] > seq + 2:
+        return last_seq, None
+    return seq, part
+
+
+# ================================================================
+# 接收进程
+# ================================================================
+def _needs_reencode(data) -> bool:
+    # 常见情况：发送端已经是 360x640 的 JPEG，原样转发，不解码也不重编码
+    return not (ASSUME_FRAME_SIZE or _jpeg_size(data) == FRAME_SIZE)
+
+def _resize_into(src: np.ndarray, dst: np.ndarray) -> None:
+    h, w = src.shape[0], src.shape[1]
+    if h == dst.shape[0] and w == dst.shape[1]:
+        dst[...] = src
+        return
+    # 缩小用 INTER_AREA（又快又不糊），放大用 INTER_LINEAR
+    interp = cv2.INTER_AREA if h * w > dst.shape[0] * dst.shape[1] else cv2.INTER_LINEAR
+    cv2.resize(src, (dst.shape[1], dst.shape[0]), dst=dst, interpolation=interp)
+
+# 重编码用的 FRAME_SIZE 输出缓冲区（I420 和 BGR 各一块），每个解码线程第一次用时分配，之后每帧复用：
+# resize 直接写进去，编码完就拷成了新的 JPEG bytes，下一帧再覆盖也没关系
+_scratch = threading.local()
+
+def _scratch_buffers() -> Tuple[np.ndarray, Tuple[np.ndarray, ...], np.ndarray]:
+    bufs = getattr(_scratch, "bufs", None)
+    if bufs is None:
+        h, w = FRAME_SIZE
+        ysize, csize = h * w, (h // 2) * (w // 2)
+        i420 = np.empty(ysize + 2 * csize, dtype=np.uint8)
+        planes = (
+            i420[:ysize].reshape(h, w),
+            i420[ysize:ysize + csize].reshape(h // 2, w // 2),
+            i420[ysize + csize:].reshape(h // 2, w // 2),
+        )
+        bgr = np.empty((h, w, 3), dtype=np.uint8)
+        bufs = _scratch.bufs = (i420, planes, bgr)
+    return bufs
+
+def _i420_from_planes(planes) -> np.ndarray:
+    """任意采样的 Y/U/V 三个平面 -> FRAME_SIZE 的 I420 连续缓冲区（Y 全尺寸，U/V 各 1/4）。"""
+    out, dsts, _ = _scratch_buffers()
+    for src, dst in zip(planes, dsts):
+        _resize_into(src, dst)
+    return out
+
+def _reencode_bgr(data) -> Optional[bytes]:
+    img = _decode_jpeg(data)
+    if img is None:
+        return None
+    if img.shape[0] != FRAME_SIZE[0] or img.shape[1] != FRAME_SIZE[1]:
+        dst = _scratch_buffers()[2]
+        _resize_into(img, dst)
+        img = dst
+    return _encode_jpeg(img)
+
+def _reencode_yuv(data) -> Optional[bytes]:
+    """
+    turbojpeg 专用：直接解到 YUV 平面，逐平面 resize 成 I420 再 encode_from_yuv。
+    省掉 YCbCr<->BGR 来回两次颜色转换，resize 的数据量也只有 BGR 的一半。
+    """
+    try:
+        planes = _tj.decode_to_yuv_planes(data)
+    except Exception:
+        return None
+    if len(planes) != 3:        # 灰度 JPEG 只有一个平面，走 BGR 路径
+        return _reencode_bgr(data)
+    try:
+        return _tj.encode_from_yuv(
+            _i420_from_planes(planes), FRAME_SIZE[0], FRAME_SIZE[1],
+            quality=JPEG_QUALITY, jpeg_subsample=TJSAMP_420,
+        )
+    except Exception:
+        return None
+
+def _reencode_jpeg(data: bytes) -> Optional[bytes]:
+    """尺寸不对的帧：解码 -> resize -> 重编码；坏包返回 None。在解码线程池里跑。"""
+    if _tj is not None:
+        return _reencode_yuv(data)
+    return _reencode_bgr(data)
+
+def _drain_latest(sock, buf: bytearray, nbytes: int) -> int:
+    """
+    非阻塞地把 socket 里已经排队的包读空，每个都覆盖进同一个 buf，最后留下的就是最新一帧。
+    实时画面旧帧没有意义，调度间隙里攒下的几个包只解码 / 转发最后一个。返回最后一个包的长度。
+    """
+    for _ in range(UDP_DRAIN_MAX):
+        try:
+            nbytes, _ = sock.recvfrom_into(buf)
+        except OSError:     # BlockingIOError：已经读空
+            break
+    return nbytes
+
+async def _receive_frames(sock, shm: shared_memory.SharedMemory):
+    loop = asyncio.get_running_loop()
+    seq = 0
+
+    # 解码 / 编码都会释放 GIL，放进线程池里并行跑，收包循环不被卡住，可以一直把 socket 读空；
+    # 同时在跑的重编码最多 VIDEO_DECODE_WORKERS 个，再多就先等一个做完（多出来的包留在内核缓冲区里）
+    pool = ThreadPoolExecutor(max_workers=VIDEO_DECODE_WORKERS, thread_name_prefix="jpeg")
+    slots = asyncio.Semaphore(VIDEO_DECODE_WORKERS)
+    pending: Set[asyncio.Task] = set()
+    frame_no = 0      # 按收包顺序给帧编号
+    written_no = 0    # 已经写进共享内存的最新帧编号，晚到的旧帧直接丢
+
+    def publish(no: int, jpg) -> None:
+        nonlocal seq, written_no
+        if no < written_no:
+            return
+        written_no = no
+        seq = _write_part(shm.buf, seq, _mjpeg_part(jpg))
+
+    async def reencode(no: int, data: bytes) -> None:
+        try:
+            jpg = await loop.run_in_executor(pool, _reencode_jpeg, data)
+        finally:
+            slots.release()
+        if jpg is not None:
+            publish(no, jpg)
+
+    # 收包缓冲区只分配一次，每个包用 sock_recvfrom_into 写进来，不再每包 new 一个 bytes
+    buf = bytearray(UDP_RECV_BUFSIZE)
+    view = memoryview(buf)
+
+    try:
+        while True:
+            try:
+                # socket 可读时才被 epoll 唤醒，没有包就一直挂着，不再 1 秒超时轮询一次
+                nbytes, addr = await loop.sock_recvfrom_into(sock, buf)
+            except Exception as e:
+                print("[UDP] recv error:", e)
+                await asyncio.sleep(0.05)
+                continue
+
+            # 积压在 socket 里的旧包直接丢，只处理最新的一个
+            nbytes = _drain_latest(sock, buf, nbytes)
+
+            frame_no += 1
+            # data 只是 buf 的视图，下一个包会覆盖它；
+            # 原样转发时 _mjpeg_part 会拷成独立的 bytes，交给线程池前也先拷一份
+            data = view[:nbytes]
+            if not _needs_reencode(data):
+                publish(frame_no, data)
+                continue
+
+            data = bytes(data)
+            no = frame_no
+            await slots.acquire()
+            task = asyncio.create_task(reencode(no, data))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    finally:
+        for task in list(pending):
+            task.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+async def _udp_receiver_main(shm_name: str, parent_pid: int):
+    from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+
+    shm = _attach_shm(shm_name)
+
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.setsockopt(SOL_SOCKET, SO_RCVBUF, UDP_SO_RCVBUF)
+    # 读回实际生效值，方便确认 sysctl 有没有配好：超过 rmem_max 时会被悄悄截断；
+    # Linux 还会把设置值翻倍（多出来的一半记 skb 开销），读回来的要除以 2 才是能放数据的大小
+    effective = sock.getsockopt(SOL_SOCKET, SO_RCVBUF)
+    if sys.platform.startswith("linux"):
+        effective //= 2
+    if effective < UDP_SO_RCVBUF:
+        print(f"[UDP] SO_RCVBUF capped at {effective} (wanted {UDP_SO_RCVBUF}); "
+              f"raise net.core.rmem_max")
+    # 接手被 kill 掉的 owner 时，旧接收进程最多要 1 秒才发现父进程没了、放开端口，这里多等几次
+    for attempt in range(UDP_BIND_RETRIES):
+        try:
+            sock.bind((UDP_IP, UDP_PORT))
+            break
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE or attempt == UDP_BIND_RETRIES - 1:
+                raise
+            await asyncio.sleep(0.5)
+    sock.setblocking(False)
+    print(f"[UDP] Listening on {UDP_IP}:{UDP_PORT} (pid {os.getpid()}, rcvbuf {effective})")
+
+    recv_task = asyncio.create_task(_receive_frames(sock, shm))
+    try:
+        # web 进程被直接 kill 掉时，自己也退出，别一直占着 UDP 端口
+        while os.getppid() == parent_pid and not recv_task.done():
+            await asyncio.sleep(1.0)
+    finally:
+        recv_task.cancel()
+        try:
+            await recv_task
+        except asyncio.CancelledError:
+            pass
+        sock.close()
+        shm.close()
+
+def _udp_receiver(shm_name: str, parent_pid: int):
+    """接收进程入口（spawn target）：自己跑一个事件循环收 UDP。"""
+    asyncio.run(_udp_receiver_main(shm_name, parent_pid))
+    print("[UDP] Receiver stopped.")
+
+
+# ================================================================
+# 给其它进程（分析 / 推理）用的只读接口
+# ================================================================
+class FrameReader:
+    """
+    按名字 attach 视频共享内存，读最新一帧，不碰 UDP socket 也不走 HTTP。
+
+    name 必须和 web 服务的 VIDEO_SHM_NAME 一致：默认名字里带的是 gunicorn master 的 pid，
+    独立启动的分析进程算不出来，部署时两边都显式设同一个 VIDEO_SHM_NAME。
+    在 web worker 进程里用也可以（段不登记到 resource_tracker，attach / close 不会动 owner 的段）。
+    建段的 worker 被重启 / kill 后段会换成新的，FrameReader 不会跟着换；长时间读不到新帧时关掉重新建一个。
+
+        reader = FrameReader(os.environ["VIDEO_SHM_NAME"])
+        seq, jpg = reader.read_jpeg()     # 没有新帧时 jpg 为 None
+        seq, img = reader.read_frame()    # BGR ndarray
+        reader.close()
+    """
+
+    def __init__(self, name: str):
+        self._shm = _attach_shm(name)
+        self.seq = 0
+
+    def read_jpeg(self) -> Tuple[int, Optional[bytes]]:
+        """比上次读到的新的一帧 JPEG；没有新帧（或这次正好撞上写入）返回 (seq, None)。"""
+        self.seq, part = _read_part(self._shm.buf, self.seq)
+        if part is None:
+            return self.seq, None
+        return self.seq, part[len(_MJPEG_PREFIX):len(part) - len(_MJPEG_SUFFIX)]
+
+    def read_frame(self) -> Tuple[int, Optional[np.ndarray]]:
+        """同 read_jpeg，解码成 BGR ndarray。"""
+        seq, jpg = self.read_jpeg()
+        if jpg is None:
+            return seq, None
+        return seq, _decode_jpeg(jpg)
+
+    def close(self) -> None:
+        self._shm.close()
+
+    def __enter__(self) -> "FrameReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ================================================================
+# web 进程这一侧
+# ================================================================
+_shm: Optional[shared_memory.SharedMemory] = None
+_shm_owner = False
+_receiver_proc: Optional[multiprocessing.process.BaseProcess] = None
+_receiver_started_at = 0.0
+_receiver_restart_at: Optional[float] = None
+_receiver_restart_delay = RECEIVER_RESTART_MIN
+_supervise_task: Optional[asyncio.Task] = None
+# 轮询共享内存的任务只在有 /video 客户端时跑，没人看时不轮询也不拷帧
+_watch_task: Optional[asyncio.Task] = None
+_subscribers = 0
+_shm_seq = 0      # 上次从共享内存读到的 seq；换段或重新开始轮询时归零
+
+# (seq, multipart 分段)，由 _poll_frame 从共享内存拷出来，所有客户端共用；
+# 整个 tuple 一次性替换，读的一方拿到的 seq 和分段一定是配套的，不需要锁
+_latest: Tuple[int, bytes] = (0, _BLANK_PART)
+_frame_event = asyncio.Event()
+
+def _notify_new_frame():
+    """换一个新事件，再把旧事件 set 掉，唤醒所有等待者。"""
+    global _frame_event
+    ev, _frame_event = _frame_event, asyncio.Event()
+    ev.set()
+
+def _poll_frame() -> None:
+    global _latest, _shm_seq
+    _shm_seq, part = _read_part(_shm.buf, _shm_seq)
+    if part is not None:
+        # 换段之后共享内存的 seq 会从头数，给客户端的编号自己单调递增
+        _latest = (_latest[0] + 1, part)
+        _notify_new_frame()
+
+async def _watch_frames():
+    while True:
+        _poll_frame()
+        await asyncio.sleep(MJPEG_POLL_INTERVAL)
+
+async def _supervise_shm():
+    """每个 worker 一直跑：每 SHM_OWNER_CHECK_INTERVAL 秒看一次 owner / 接收进程（见 _check_shm）。"""
+    global _shm_seq
+    while True:
+        await asyncio.sleep(SHM_OWNER_CHECK_INTERVAL)
+        if _check_shm():
+            _shm_seq = 0
+
+def _subscribe() -> None:
+    global _subscribers, _watch_task, _shm_seq
+    _subscribers += 1
+    if _watch_task is None:
+        # 停过一阵的话 _latest 是旧帧：先同步读一次当前帧，再开始轮询
+        _shm_seq = 0
+        _poll_frame()
+        _watch_task = asyncio.create_task(_watch_frames())
+
+def _unsubscribe() -> None:
+    global _subscribers, _watch_task
+    _subscribers -= 1
+    if _subscribers == 0 and _watch_task is not None:
+        _watch_task.cancel()
+        _watch_task = None
+
+async def frame_generator() -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    min_interval = 1.0 / MJPEG_MAX_FPS if MJPEG_MAX_FPS > 0 else 0.0
+    sent_seq = -1
+    next_send = 0.0
+    # 客户端断开时 StreamingResponse 会关掉这个生成器，finally 里退订，最后一个走了就停掉轮询
+    _subscribe()
+    try:
+        while True:
+            # 限速：离上一帧还不到 1/MJPEG_MAX_FPS 秒就先等等，期间来的帧只发最新那一个
+            delay = next_send - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # 先拿事件再读帧：读完之后到的新帧一定会 set 这个事件
+            ev = _frame_event
+            seq, part = _latest
+
+            # 同一帧不重复发
+            if seq != sent_seq:
+                yield part
+                sent_seq = seq
+                next_send = loop.time() + min_interval
+
+            try:
+                await asyncio.wait_for(ev.wait(), MJPEG_KEEPALIVE)
+            except asyncio.TimeoutError:
+                sent_seq = -1   # 太久没有新帧，下一轮把当前帧再发一遍保活
+    finally:
+        _unsubscribe()
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+@contextmanager
+def _shm_lock():
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(tempfile.gettempdir(), f"{VIDEO_SHM_NAME}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def _open_shm() -> None:
+    """
+    建出或 attach VIDEO_SHM_NAME，在 _shm_lock() 里调用。
+    名字下是 owner 已经不在了的旧段（比如 owner 被 kill -9，段留在 /dev/shm 里）就删掉重建，自己接手。
+    """
+    global _shm, _shm_owner
+    try:
+        shm = _create_shm(VIDEO_SHM_NAME)
+    except FileExistsError:
+        shm = _attach_shm(VIDEO_SHM_NAME)
+        if _pid_alive(_SHM_OWNER.unpack_from(shm.buf, _SHM_OWNER_OFFSET)[0]):
+            _shm, _shm_owner = shm, False
+            return
+        _unlink_shm(shm)
+        shm.close()
+        shm = _create_shm(VIDEO_SHM_NAME)
+    _SHM_OWNER.pack_into(shm.buf, _SHM_OWNER_OFFSET, os.getpid())
+    _shm, _shm_owner = shm, True
+
+def _start_receiver() -> None:
+    global _receiver_proc, _receiver_started_at
+    ctx = multiprocessing.get_context("spawn")
+    _receiver_proc = ctx.Process(
+        target=_udp_receiver,
+        args=(VIDEO_SHM_NAME, os.getpid()),
+        name="udp-receiver",
+        daemon=True,
+    )
+    _receiver_proc.start()
+    _receiver_started_at = time.monotonic()
+
+def _check_receiver() -> None:
+    """owner 定期调用：接收进程退出了就打一行日志，按退避间隔重新拉起。"""
+    global _receiver_restart_at, _receiver_restart_delay
+    if _receiver_proc is None or _receiver_proc.is_alive():
+        return
+    now = time.monotonic()
+    if _receiver_restart_at is None:
+        # 跑了很久才退出的算偶发，退避从头开始；刚拉起就退出的（端口一直被占）间隔越拉越长
+        if now - _receiver_started_at >= RECEIVER_RESTART_MAX:
+            _receiver_restart_delay = RECEIVER_RESTART_MIN
+        _receiver_restart_at = now + _receiver_restart_delay
+        print(f"[VIDEO] UDP receiver exited (code {_receiver_proc.exitcode}); "
+              f"restarting in {_receiver_restart_delay:.0f}s")
+        _receiver_restart_delay = min(_receiver_restart_delay * 2, RECEIVER_RESTART_MAX)
+    elif now >= _receiver_restart_at:
+        _receiver_restart_at = None
+        _start_receiver()
+
+def _check_shm() -> bool:
+    """
+    每个 worker 定期调用。owner：看住自己的接收进程（_check_receiver）。
+    其余 worker：owner 还活着就什么都不做；owner 不在了
+    （正常退出时段已被删，被 kill 时段成了旧段），重新建 / attach，必要时自己当 owner。换了段返回 True。
+    """
+    if _shm_owner:
+        _check_receiver()
+        return False
+    if _pid_alive(_SHM_OWNER.unpack_from(_shm.buf, _SHM_OWNER_OFFSET)[0]):
+        return False
+
+    old = _shm
+    with _shm_lock():
+        _open_shm()
+    old.close()
+    if _shm_owner:
+        _start_receiver()
+    print(f"[VIDEO] Owner of {VIDEO_SHM_NAME} is gone; "
+          f"{'took over' if _shm_owner else 're-attached'}")
+    return True
+
+def start_video():
+    """
+    在事件循环里调用（FastAPI startup）。
+    第一个建出共享内存的 worker 负责拉起接收进程，其余 worker 只 attach 读；
+    owner 不在了以后，由最先发现的 worker 接手（见 _check_shm）。
+    """
+    global _supervise_task
+
+    with _shm_lock():
+        _open_shm()
+    if _shm_owner:
+        _start_receiver()
+
+    _supervise_task = asyncio.create_task(_supervise_shm())
+
+async def stop_video():
+    global _shm, _receiver_proc, _supervise_task, _watch_task
+
+    for task in (_supervise_task, _watch_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _supervise_task = _watch_task = None
+
+    if _receiver_proc is not None:
+        _receiver_proc.terminate()
+        _receiver_proc.join(timeout=2.0)
+        _receiver_proc = None
+
+    if _shm is not None:
+        if _shm_owner:
+            _unlink_shm(_shm)
+        _shm.close()
+        _shm = None